@@ -1,11 +1,16 @@
 import os
+import asyncio
+import contextlib
 import logging
 import sqlite3
+import threading
+import time
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.helpers import mention_html
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     PollAnswerHandler,
@@ -16,6 +21,39 @@ from telegram.ext import (
 BOT_NAME = "AlphaverseArc_bot"
 POINTS_PER_POLL = 1
 DB_PATH = "bot_data.db"
+AWARD_BATCH_SIZE = 500
+AWARD_FLUSH_INTERVAL = 0.05  # seconds
+LEADERBOARD_CACHE_TTL = 5  # seconds
+POLL_TTL_DAYS = 30  # polls older than this stop scoring and are deleted
+POLL_PRUNE_INTERVAL = 3600  # seconds
+# Stay under Telegram's 4096-char message and 100-button keyboard limits
+WHITELIST_PAGE_CHARS = 3500
+WHITELIST_PAGE_BUTTONS = 100
+
+# --- SQL ---
+# Hot-path statements live in constants so sqlite3's per-connection
+# statement cache (keyed by SQL text) reuses the prepared statement
+INSERT_POLL_SQL = "INSERT OR IGNORE INTO polls(poll_id, created_at) VALUES (?, ?)"
+INSERT_ANSWER_SQL = "INSERT OR IGNORE INTO poll_answers(poll_id, user_id) VALUES (?, ?)"
+UPSERT_POINTS_SQL = """
+    INSERT INTO user_points(user_id, username, points)
+    VALUES (?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        points = points + ?,
+        username = excluded.username
+"""
+SELECT_POINTS_SQL = "SELECT points FROM user_points WHERE user_id = ?"
+SELECT_TOP_SQL = "SELECT username, points FROM user_points ORDER BY points DESC LIMIT ?"
+SELECT_WHITELIST_SQL = """
+    SELECT user_id, COALESCE(username, 'user')
+    FROM user_points
+    WHERE points >= ?
+    ORDER BY points DESC
+"""
+
+# Serializes writes on the shared connection between the executor threads
+# that run_db() dispatches to; handlers themselves all run on the event loop
+DB_LOCK = threading.Lock()
 
 # --- Logging ---
 logging.basicConfig(
@@ -25,9 +63,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- Database setup ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+def init_db() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
     c = conn.cursor()
+    # WAL lets readers run alongside the writer; NORMAL skips the per-commit fsync
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA cache_size=-64000")
+    c.execute("PRAGMA busy_timeout=5000")
     c.execute("""
         CREATE TABLE IF NOT EXISTS user_points (
             user_id INTEGER PRIMARY KEY,
@@ -35,52 +79,210 @@ def init_db():
             points INTEGER DEFAULT 0
         )
     """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS poll_answers (
+    # Keyed WITHOUT ROWID so the (poll_id, user_id) b-tree is the table itself
+    # rather than a separate UNIQUE index pointing into a rowid table
+    poll_answers_ddl = """
+        CREATE TABLE IF NOT EXISTS {} (
             poll_id TEXT,
             user_id INTEGER,
-            UNIQUE(poll_id, user_id)
+            PRIMARY KEY (poll_id, user_id)
+        ) WITHOUT ROWID
+    """
+    row = c.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'poll_answers'"
+    ).fetchone()
+    if row and "WITHOUT ROWID" not in row[0].upper():
+        # One-time migration from the original rowid layout
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute(poll_answers_ddl.format("poll_answers_new"))
+            c.execute(
+                "INSERT OR IGNORE INTO poll_answers_new(poll_id, user_id) "
+                "SELECT poll_id, user_id FROM poll_answers"
+            )
+            c.execute("DROP TABLE poll_answers")
+            c.execute("ALTER TABLE poll_answers_new RENAME TO poll_answers")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+    c.execute(poll_answers_ddl.format("poll_answers"))
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS polls (
+            poll_id TEXT PRIMARY KEY,
+            created_at INTEGER
         )
     """)
-    conn.commit()
-    conn.close()
-
-def add_point(user_id: int, username: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        """
-        INSERT INTO user_points(user_id, username, points)
-        VALUES (?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            points = points + ?,
-            username = excluded.username
-        """,
-        (user_id, username, POINTS_PER_POLL, POINTS_PER_POLL),
-    )
-    conn.commit()
-    conn.close()
-
-def has_answered(poll_id: str, user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "SELECT 1 FROM poll_answers WHERE poll_id = ? AND user_id = ?",
-        (poll_id, user_id),
-    )
-    result = c.fetchone()
-    conn.close()
-    return bool(result)
+    # Covers the leaderboard/whitelist ORDER BY points DESC scans
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_points_desc
+        ON user_points(points DESC, username, user_id)
+    """)
+    return conn
 
-def mark_answered(poll_id: str, user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR IGNORE INTO poll_answers(poll_id, user_id) VALUES (?, ?)",
-        (poll_id, user_id),
+# Read-only connection for score/leaderboard/whitelist; with WAL these
+# reads never wait on the writer
+def init_read_db() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False, isolation_level=None
     )
-    conn.commit()
-    conn.close()
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+def add_poll(conn: sqlite3.Connection, poll_id: str):
+    with DB_LOCK:
+        conn.execute(INSERT_POLL_SQL, (poll_id, int(time.time())))
+
+# Deletes polls older than POLL_TTL_DAYS together with their answers in one
+# transaction and returns the expired poll ids
+def prune_polls(conn: sqlite3.Connection) -> set:
+    cutoff = int(time.time()) - POLL_TTL_DAYS * 86400
+    with DB_LOCK:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            c = conn.execute("SELECT poll_id FROM polls WHERE created_at < ?", (cutoff,))
+            expired = {pid for (pid,) in c}
+            conn.execute(
+                "DELETE FROM poll_answers WHERE poll_id IN "
+                "(SELECT poll_id FROM polls WHERE created_at < ?)",
+                (cutoff,),
+            )
+            conn.execute("DELETE FROM polls WHERE created_at < ?", (cutoff,))
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    return expired
+
+def load_active_polls(conn: sqlite3.Connection) -> set:
+    prune_polls(conn)
+    c = conn.execute("SELECT poll_id FROM polls")
+    return {pid for (pid,) in c}
+
+def load_answered(conn: sqlite3.Connection, poll_ids) -> dict:
+    answered = {pid: set() for pid in poll_ids}
+    c = conn.execute("SELECT poll_id, user_id FROM poll_answers JOIN polls USING (poll_id)")
+    for pid, uid in c:
+        if pid in answered:
+            answered[pid].add(uid)
+    return answered
+
+# Records one answer and awards points if it is new; must run inside
+# a transaction held under DB_LOCK
+def try_award(conn: sqlite3.Connection, poll_id: str, user_id: int, username: str) -> bool:
+    # rowcount is 0 when the answer was already recorded and ignored
+    if conn.execute(INSERT_ANSWER_SQL, (poll_id, user_id)).rowcount != 1:
+        return False
+    conn.execute(UPSERT_POINTS_SQL, (user_id, username, POINTS_PER_POLL, POINTS_PER_POLL))
+    return True
+
+# Records (poll_id, user_id, username) answers in one transaction and
+# returns the ones that were new and therefore earned points
+def award_batch(conn: sqlite3.Connection, awards: list) -> list:
+    with DB_LOCK:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            new = [award for award in awards if try_award(conn, *award)]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    return new
+
+def get_points(conn: sqlite3.Connection, user_id: int) -> int:
+    c = conn.execute(SELECT_POINTS_SQL, (user_id,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+def top_users(conn: sqlite3.Connection, limit: int = 10) -> list:
+    c = conn.execute(SELECT_TOP_SQL, (limit,))
+    return c.fetchall()
+
+def users_with_points(conn: sqlite3.Connection, threshold: int) -> list:
+    c = conn.execute(SELECT_WHITELIST_SQL, (threshold,))
+    return c.fetchall()
+
+# Runs a blocking DB helper on the default executor so it doesn't stall the
+# event loop (works on every Python PTB 20 supports, unlike asyncio.to_thread)
+def run_db(func, *args):
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+# --- Award batching ---
+async def award_worker(app: Application):
+    queue = app.bot_data["award_queue"]
+    conn = app.bot_data["db"]
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + AWARD_FLUSH_INTERVAL
+        while len(batch) < AWARD_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            awarded = await run_db(award_batch, conn, batch)
+            if awarded:
+                # Invalidate the cached leaderboard
+                app.bot_data["lb_version"] = app.bot_data.get("lb_version", 0) + 1
+            for pid, uid, _ in awarded:
+                logger.info("Awarded %d point to %d for poll %s", POINTS_PER_POLL, uid, pid)
+        except Exception:
+            logger.exception("Failed to record %d poll answer(s)", len(batch))
+            # The batch was rolled back; forget these answers so a later
+            # vote from the same users can be recorded again
+            answered = app.bot_data["answered"]
+            for pid, uid, _ in batch:
+                answered.get(pid, set()).discard(uid)
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+# --- Poll expiry ---
+async def poll_pruner(app: Application):
+    while True:
+        await asyncio.sleep(POLL_PRUNE_INTERVAL)
+        try:
+            expired = await run_db(prune_polls, app.bot_data["db"])
+        except Exception:
+            logger.exception("Failed to prune expired polls")
+            continue
+        if not expired:
+            continue
+        active = app.bot_data["active_polls"]
+        active.difference_update(expired)
+        app.bot_data["active_polls_snap"] = frozenset(active)
+        for pid in expired:
+            app.bot_data["answered"].pop(pid, None)
+        logger.info("Pruned %d expired poll(s)", len(expired))
+
+async def start_workers(app: Application):
+    app.bot_data["award_queue"] = asyncio.Queue()
+    app.bot_data["award_task"] = asyncio.create_task(award_worker(app))
+    app.bot_data["prune_task"] = asyncio.create_task(poll_pruner(app))
+
+async def stop_workers(app: Application):
+    # Flush whatever is still queued before shutting down
+    await app.bot_data["award_queue"].join()
+    for key in ("award_task", "prune_task"):
+        task = app.bot_data[key]
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+def close_db(app: Application):
+    # Closing the writer last checkpoints the WAL and removes -wal/-shm
+    app.bot_data["rdb"].close()
+    app.bot_data["db"].close()
+
+async def shutdown(app: Application):
+    await stop_workers(app)
+    close_db(app)
 
 # --- Command handlers ---
 async def start(update: Update, _: ContextTypes.DEFAULT_TYPE):
@@ -90,72 +292,79 @@ async def start(update: Update, _: ContextTypes.DEFAULT_TYPE):
     )
 
 async def createpoll(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.partition(" ")[2]
-    if "?" not in text or ";" not in text:
+    question, _, rest = update.message.text.partition(" ")[2].partition("?")
+    question = question.strip()
+    if not question or not rest:
         return await update.message.reply_text(
             "Usage: /createpoll Question? Option1;Option2;Option3"
         )
 
-    question, opts = text.split("?", 1)
-    options = [opt.strip() for opt in opts.split(";") if opt.strip()]
+    options = tuple(opt for opt in map(str.strip, rest.split(";")) if opt)
     if len(options) < 2:
         return await update.message.reply_text("Provide at least 2 options.")
 
     poll_message = await update.message.reply_poll(
-        question.strip() + "?",
+        question + "?",
         options,
         is_anonymous=False,
         allows_multiple_answers=False,
     )
 
-    # Store this poll's ID globally so answers can be matched later
+    # Store this poll's ID globally so answers can be matched later. This
+    # happens before any further await so concurrent answers are not dropped.
     active = context.bot_data.get("active_polls")
     if active is None:
         active = set()
         context.bot_data["active_polls"] = active
     active.add(poll_message.poll.id)
-    logger.info(f"Created poll {poll_message.poll.id}")
+    context.bot_data.setdefault("answered", {})[poll_message.poll.id] = set()
+    # Readers only ever see a complete snapshot; rebinding the key is atomic
+    context.bot_data["active_polls_snap"] = frozenset(active)
+
+    # Persist it so scoring survives a restart
+    await run_db(add_poll, context.bot_data["db"], poll_message.poll.id)
+    logger.info("Created poll %s", poll_message.poll.id)
 
 async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     answer = update.poll_answer
     pid = answer.poll_id
     uid = answer.user.id
 
-    active = context.bot_data.get("active_polls", set())
+    active = context.bot_data.get("active_polls_snap", frozenset())
     if pid not in active:
-        logger.debug(f"Ignoring answer for unknown poll {pid}")
+        logger.debug("Ignoring answer for unknown poll %s", pid)
         return
 
-    # If they haven't answered this poll before, give them points
-    if not has_answered(pid, uid):
-        mark_answered(pid, uid)
-        add_point(uid, answer.user.username or answer.user.first_name)
-        logger.info(f"Awarded {POINTS_PER_POLL} point to {uid} for poll {pid}")
-    else:
-        logger.debug(f"User {uid} already answered poll {pid}")
+    # If they haven't answered this poll before, queue their points
+    answered = context.bot_data["answered"].setdefault(pid, set())
+    if uid in answered:
+        logger.debug("User %d already answered poll %s", uid, pid)
+        return
+    answered.add(uid)
+    context.bot_data["award_queue"].put_nowait(
+        (pid, uid, answer.user.username or answer.user.first_name)
+    )
 
-async def score(update: Update, _: ContextTypes.DEFAULT_TYPE):
+async def score(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT points FROM user_points WHERE user_id = ?", (uid,))
-    row = c.fetchone()
-    conn.close()
-    pts = row[0] if row else 0
+    pts = await run_db(get_points, context.bot_data["rdb"], uid)
     await update.message.reply_text(f"You have {pts} point(s).")
 
-async def leaderboard(update: Update, _: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT username, points FROM user_points ORDER BY points DESC LIMIT 10")
-    top = c.fetchall()
-    conn.close()
+async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    version = context.bot_data.get("lb_version", 0)
+    cached_text, ts, cached_version = context.bot_data.get("lb_cache", (None, 0, None))
+    if cached_version == version and time.monotonic() - ts < LEADERBOARD_CACHE_TTL:
+        return await update.message.reply_text(cached_text)
 
-    if not top:
-        return await update.message.reply_text("No scores yet.")
+    top = await run_db(top_users, context.bot_data["rdb"])
 
-    text = "\n".join(f"{i+1}. {u}: {p}" for i, (u, p) in enumerate(top))
-    await update.message.reply_text(f"🏆 Top Participants:\n\n{text}")
+    if top:
+        text = "\n".join(f"{i+1}. {u}: {p}" for i, (u, p) in enumerate(top))
+        text = f"🏆 Top Participants:\n\n{text}"
+    else:
+        text = "No scores yet."
+    context.bot_data["lb_cache"] = (text, time.monotonic(), version)
+    await update.message.reply_text(text)
 
 async def whitelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # parse threshold
@@ -165,58 +374,70 @@ async def whitelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /whitelist <min_points>")
         return
 
-    logger.info(f"[/whitelist] called with threshold={threshold}")
+    logger.info("[/whitelist] called with threshold=%d", threshold)
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "SELECT user_id, username FROM user_points WHERE points >= ? ORDER BY points DESC",
-        (threshold,),
-    )
-    rows = c.fetchall()
-    conn.close()
+    rows = await run_db(users_with_points, context.bot_data["rdb"], threshold)
 
-    logger.info(f"[/whitelist] found {len(rows)} users with ≥{threshold} points")
+    logger.info("[/whitelist] found %d users with ≥%d points", len(rows), threshold)
 
     if not rows:
         return await update.message.reply_text("No users meet that threshold yet.")
 
-    # Build HTML mentions
-    mentions = [mention_html(uid, uname) for uid, uname in rows]
-    text = "✅ Whitelisted Users:\n" + "\n".join(mentions)
-
-    # Fallback buttons
-    buttons = [
-        [InlineKeyboardButton(uname, url=f"tg://user?id={uid}")]
-        for uid, uname in rows
-    ]
-    markup = InlineKeyboardMarkup(buttons)
-
-    await update.message.reply_text(
-        text,
-        parse_mode=ParseMode.HTML,
-        reply_markup=markup
-    )
+    # Build HTML mentions and fallback buttons in one pass, split into pages
+    pages = []
+    mentions, buttons = ["✅ Whitelisted Users:"], []
+    size = len(mentions[0])
+    for uid, uname in rows:
+        mention = mention_html(uid, uname)
+        if size + len(mention) + 1 > WHITELIST_PAGE_CHARS or len(buttons) >= WHITELIST_PAGE_BUTTONS:
+            pages.append((mentions, buttons))
+            mentions, buttons, size = [], [], 0
+        mentions.append(mention)
+        buttons.append([InlineKeyboardButton(uname, url=f"tg://user?id={uid}")])
+        size += len(mention) + 1
+    pages.append((mentions, buttons))
+
+    for mentions, buttons in pages:
+        await update.message.reply_text(
+            "\n".join(mentions),
+            parse_mode=ParseMode.HTML,
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
 
 # --- Main entrypoint ---
 def main():
-    init_db()
     token = os.getenv("BOT_TOKEN")
     if not token:
         logger.error("BOT_TOKEN env var is missing.")
         return
 
-    app = ApplicationBuilder().token(token).build()
-
-    # register handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("createpoll", createpoll))
-    app.add_handler(PollAnswerHandler(handle_poll_answer))
-    app.add_handler(CommandHandler("score", score))
-    app.add_handler(CommandHandler("leaderboard", leaderboard))
-    app.add_handler(CommandHandler("whitelist", whitelist))
+    conn = init_db()
 
-    logger.info(f"Starting {BOT_NAME}…")
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(True)
+        .post_init(start_workers)
+        .post_shutdown(shutdown)
+        .build()
+    )
+    app.bot_data["db"] = conn
+    app.bot_data["rdb"] = init_read_db()
+    app.bot_data["active_polls"] = load_active_polls(conn)
+    app.bot_data["active_polls_snap"] = frozenset(app.bot_data["active_polls"])
+    app.bot_data["answered"] = load_answered(conn, app.bot_data["active_polls"])
+
+    # register handlers; they run as concurrent tasks on the event loop, which
+    # is safe because each one updates bot_data without awaiting in between
+    # and hands blocking DB work to run_db(), where DB_LOCK orders the writes
+    app.add_handler(CommandHandler("start", start, block=False))
+    app.add_handler(CommandHandler("createpoll", createpoll, block=False))
+    app.add_handler(PollAnswerHandler(handle_poll_answer, block=False))
+    app.add_handler(CommandHandler("score", score, block=False))
+    app.add_handler(CommandHandler("leaderboard", leaderboard, block=False))
+    app.add_handler(CommandHandler("whitelist", whitelist, block=False))
+
+    logger.info("Starting %s…", BOT_NAME)
     app.run_polling()
 
 if __name__ == "__main__":